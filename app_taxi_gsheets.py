@@ -1,8 +1,17 @@
+import functools
+import time
+
+import numpy as np
 import pandas as pd
 import streamlit as st
 from datetime import date
 import gspread
 
+# Copy-on-write: las copias son perezosas y solo se duplica el bloque modificado
+# (desde pandas 3 viene siempre activo y la opción está en desuso)
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
 # =========================
 # CONFIG PÁGINA (nombre/ícono)
 # =========================
@@ -46,60 +55,103 @@ COL_GAST = "GASTOS"
 
 CONDUCTORES = ["JORGE", "ERIK"]
 
+# Segundos que se reutiliza la lectura de la hoja (caché compartida y df de cada
+# sesión). Cambios hechos desde otro dispositivo o directamente en Sheets se ven al
+# vencer el df de la sesión: como máximo TTL_HOJA, salvo el primer df de la sesión,
+# que puede venir de una lectura compartida y tardar hasta 2 x TTL_HOJA
+TTL_HOJA = 300
+
+# Tipos compactos de las columnas (ver read_sheet)
+TIPOS = {
+    COL_PROD: "float64[pyarrow]",
+    COL_GAST: "float64[pyarrow]",
+    COL_COND: pd.CategoricalDtype(CONDUCTORES),
+    COL_OBS: "string[pyarrow]",
+}
+
 # =========================
 # FECHAS EN ESPAÑOL
 # =========================
-MESES_ES = {
-    1: "enero", 2: "febrero", 3: "marzo", 4: "abril", 5: "mayo", 6: "junio",
-    7: "julio", 8: "agosto", 9: "septiembre", 10: "octubre", 11: "noviembre", 12: "diciembre"
-}
-DIAS_ES = {
-    0: "lunes", 1: "martes", 2: "miércoles", 3: "jueves",
-    4: "viernes", 5: "sábado", 6: "domingo"
-}
+# Arreglos (no dicts) para poder indexar columnas completas de una vez
+MESES_ES = np.array([
+    "", "enero", "febrero", "marzo", "abril", "mayo", "junio",
+    "julio", "agosto", "septiembre", "octubre", "noviembre", "diciembre"
+], dtype=object)
+DIAS_ES = np.array([
+    "lunes", "martes", "miércoles", "jueves", "viernes", "sábado", "domingo"
+], dtype=object)
 
 def fecha_es(d):
     if d is None or pd.isna(d):
         return ""
     return f"{DIAS_ES[d.weekday()]} {d.day} {MESES_ES[d.month]} {d.year}"
 
+def fecha_es_serie(s):
+    # Igual que fecha_es, pero para toda la columna de una vez
+    d = pd.to_datetime(s, errors="coerce")
+    ok = d.notna().to_numpy()
+    v = d[ok].dt
+    texto = np.full(len(d), "", dtype=object)
+    texto[ok] = (
+        DIAS_ES[v.weekday.to_numpy()] + " " + v.day.astype(str).to_numpy() + " "
+        + MESES_ES[v.month.to_numpy()] + " " + v.year.astype(str).to_numpy()
+    )
+    return pd.Series(texto, index=s.index)
+
 # =========================
 # FORMATO PESOS COLOMBIANOS
 # =========================
+@functools.lru_cache(maxsize=4096)
+def _pesos_entero(n: int) -> str:
+    return f"$ {n:,}".replace(",", ".")
+
 def formato_pesos(valor):
     try:
-        valor = float(valor)
+        return _pesos_entero(int(round(float(valor))))
     except Exception:
-        valor = 0.0
-    return f"$ {valor:,.0f}".replace(",", ".")
+        return "$ 0"
+
+def formato_pesos_serie(s):
+    # Igual que formato_pesos, pero para toda la columna de una vez
+    enteros = pd.to_numeric(s, errors="coerce").fillna(0).round().astype("int64").astype(str)
+    return ("$ " + enteros).str.replace(r"(\d)(?=(\d{3})+$)", r"\1.", regex=True)
 
 # =========================
 # GOOGLE SHEETS (gspread)
 # =========================
+@st.cache_resource
+def _get_client():
+    # [service_account] ... (contenido del JSON) debe existir en st.secrets
+    sa_info = dict(st.secrets["service_account"])
+    return gspread.service_account_from_dict(sa_info)
+
+@st.cache_resource
 def get_ws():
     # Deben existir en st.secrets:
     # spreadsheet_id = "..."
     # worksheet_name = "datos"
-    # [service_account] ... (contenido del JSON)
+    # Se cachea para no re-autenticar ni reabrir la hoja en cada rerun
     spreadsheet_id = st.secrets["spreadsheet_id"]
     worksheet_name = st.secrets.get("worksheet_name", "datos")
+    return _get_client().open_by_key(spreadsheet_id).worksheet(worksheet_name)
 
-    sa_info = dict(st.secrets["service_account"])
-    gc = gspread.service_account_from_dict(sa_info)
-    sh = gc.open_by_key(spreadsheet_id)
-    ws = sh.worksheet(worksheet_name)
-    return ws
-
-@st.cache_data(ttl=15)
+@st.cache_data(ttl=TTL_HOJA, show_spinner=False)
 def read_sheet() -> pd.DataFrame:
     ws = get_ws()
-    values = ws.get_all_values()
+    # Solo el rango usado (A:E); los números llegan como números, no como texto
+    values = ws.get(
+        "A:E",
+        value_render_option="UNFORMATTED_VALUE",
+        date_time_render_option="FORMATTED_STRING",
+    )
 
     if not values or len(values) < 1:
         return pd.DataFrame(columns=[COL_FECHA, COL_PROD, COL_COND, COL_OBS, COL_GAST])
 
-    headers = [h.strip() for h in values[0]]
-    rows = values[1:]
+    headers = [str(h).strip() for h in values[0]]
+    # La API omite las celdas vacías al final de cada fila
+    n = len(headers)
+    rows = [r[:n] + [""] * (n - len(r)) for r in values[1:]]
     df = pd.DataFrame(rows, columns=headers)
 
     for c in [COL_FECHA, COL_PROD, COL_COND, COL_OBS, COL_GAST]:
@@ -110,70 +162,124 @@ def read_sheet() -> pd.DataFrame:
     df = df.dropna(how="all")
 
     df[COL_FECHA] = pd.to_datetime(df[COL_FECHA], errors="coerce").dt.date
-    df[COL_PROD] = pd.to_numeric(df[COL_PROD], errors="coerce").fillna(0)
-    df[COL_GAST] = pd.to_numeric(df[COL_GAST], errors="coerce").fillna(0)
-    df[COL_COND] = df[COL_COND].astype(str).str.upper().str.strip()
-    df[COL_OBS] = df[COL_OBS].fillna("")
-
-    return df.sort_values([COL_FECHA, COL_COND], na_position="last").reset_index(drop=True)
-
-def write_sheet(df: pd.DataFrame):
+    # Con UNFORMATTED_VALUE ya llegan como números; solo se limpian vacíos/texto
+    for c in [COL_PROD, COL_GAST]:
+        df[c] = pd.to_numeric(df[c], errors="coerce").fillna(0)
+    # CONDUCTOR vacío o desconocido queda como NaN antes de pasar a categoría
+    cond = df[COL_COND].astype(str).str.upper().str.strip()
+    df[COL_COND] = cond.where(cond.isin(CONDUCTORES))
+    df[COL_OBS] = df[COL_OBS].fillna("").astype(str)
+    df = df.astype(TIPOS)
+
+    # Sin ordenar: el índice es la posición en la hoja (fila = índice + 2, la 1 es el encabezado)
+    return df
+
+def filas_vigentes(updated_rows):
+    # Las posiciones salen del df en caché: antes de escribir se confirma que cada
+    # fila de la hoja sigue siendo la misma FECHA/CONDUCTOR (alguien pudo borrar,
+    # insertar u ordenar filas directamente en Sheets). Las filas nuevas no pasan
+    # por aquí: antes de agregarlas siempre se relee la hoja
+    if not updated_rows:
+        return True
+    actuales = get_ws().batch_get(
+        [f"A{r}:C{r}" for r, _ in updated_rows],
+        value_render_option="UNFORMATTED_VALUE",
+        date_time_render_option="FORMATTED_STRING",
+    )
+    for rango, (_, vals) in zip(actuales, updated_rows):
+        fila = list(rango[0]) if rango else []
+        if len(fila) < 3:
+            return False
+        if pd.to_datetime(fila[0], errors="coerce") != pd.Timestamp(vals[0]):
+            return False
+        if str(fila[2]).upper().strip() != vals[2]:
+            return False
+    return True
+
+def write_sheet(updated_rows, new_rows, header=False):
+    # updated_rows: [(fila_hoja, valores)] ya existentes; new_rows: [valores] nuevos
+    if not updated_rows and not new_rows:
+        return
     ws = get_ws()
-    out = df.copy()
-    out[COL_FECHA] = out[COL_FECHA].astype(str)
 
-    data = [out.columns.tolist()] + out.astype(str).values.tolist()
-    ws.clear()
-    ws.update("A1", data)
+    if updated_rows:
+        ws.batch_update(
+            [{"range": f"A{r}:E{r}", "values": [vals]} for r, vals in updated_rows],
+            value_input_option="RAW",
+        )
+    if new_rows:
+        # Caso típico (día nuevo): una sola llamada que no toca las filas existentes
+        if header:
+            new_rows = [[COL_FECHA, COL_PROD, COL_COND, COL_OBS, COL_GAST]] + new_rows
+        ws.append_rows(new_rows, value_input_option="RAW")
 
 # =========================
 # LÓGICA DE REGISTRO (1 gasto por día)
 # =========================
 def upsert_day(df, fecha, prod_jorge, prod_erik, gastos, observacion):
-    df = df.copy()
+    # Copia superficial: con copy-on-write no se duplican datos hasta modificarlos
+    df = df.copy(deep=False)
+    updated_rows = []
+    new_rows = []
+    # Índice (FECHA, CONDUCTOR) armado en una sola pasada (O(N) por guardado) en vez de
+    # dos máscaras completas por conductor; luego cada búsqueda es por hash
+    claves = pd.MultiIndex.from_arrays([df[COL_FECHA], df[COL_COND]])
 
     def set_row(conductor, producido, obs, gast):
-        nonlocal df
-        mask = (df[COL_FECHA] == fecha) & (df[COL_COND] == conductor)
-        if mask.any():
-            df.loc[mask, COL_PROD] = producido
-            df.loc[mask, COL_OBS] = obs
-            df.loc[mask, COL_GAST] = gast
+        vals = [str(fecha), producido, conductor, obs, gast]
+        pos = claves.get_indexer_for([(fecha, conductor)])
+        if pos[0] >= 0:
+            filas = df.index[pos]
+            # Si las filas ya tienen esos valores no hay nada que escribir
+            actuales = df.loc[filas, [COL_PROD, COL_OBS, COL_GAST]].values.tolist()
+            if all(a == [producido, obs, gast] for a in actuales):
+                return
+            df.loc[filas, [COL_PROD, COL_OBS, COL_GAST]] = [producido, obs, gast]
+            # Filas repetidas (misma fecha y conductor): se escriben todas, igual que en el df
+            updated_rows.extend((int(i) + 2, vals) for i in filas)
         else:
-            df = pd.concat([df, pd.DataFrame([{
+            # La fila nueva queda al final de la hoja (append_rows)
+            idx = int(df.index.max()) + 1 if len(df) else 0
+            df.loc[idx] = {
                 COL_FECHA: fecha,
                 COL_PROD: producido,
                 COL_COND: conductor,
                 COL_OBS: obs,
                 COL_GAST: gast
-            }])], ignore_index=True)
+            }
+            new_rows.append(vals)
 
     # Gastos y observación del día: se guardan en la fila de JORGE (solo 1 por día)
     set_row("JORGE", prod_jorge, observacion, gastos)
     set_row("ERIK",  prod_erik,  "",          0)
 
-    return df.sort_values([COL_FECHA, COL_COND], na_position="last").reset_index(drop=True)
+    # Agregar filas con df.loc pierde los tipos compactos: se restauran
+    if new_rows:
+        df = df.astype(TIPOS)
+
+    return df, updated_rows, new_rows
 
+# Solo se recalcula cuando cambia el contenido del df
+@st.cache_data(
+    show_spinner=False,
+    max_entries=8,
+    hash_funcs={pd.DataFrame: lambda d: pd.util.hash_pandas_object(d, index=False).sum()},
+)
 def daily_summary(df):
     if df.empty:
         return pd.DataFrame()
 
-    pivot = df.pivot_table(
-        index=COL_FECHA,
-        columns=COL_COND,
-        values=COL_PROD,
-        aggfunc="sum",
-        fill_value=0
-    ).reset_index()
-
-    for c in CONDUCTORES:
-        if c not in pivot.columns:
-            pivot[c] = 0
-
-    gastos = df.groupby(COL_FECHA)[COL_GAST].max().reset_index()
-    obs = df.groupby(COL_FECHA)[COL_OBS].max().reset_index()
-
-    resumen = pivot.merge(gastos, on=COL_FECHA, how="left").merge(obs, on=COL_FECHA, how="left")
+    # Una sola pasada: producido por conductor en columnas, gastos/obs del día
+    por_conductor = {c: np.where(df[COL_COND] == c, df[COL_PROD], 0) for c in CONDUCTORES}
+    # Gastos y observación solo viven en la fila de JORGE: se toma esa, sin max sobre texto
+    es_jorge = df[COL_COND] == "JORGE"
+    del_dia = {COL_GAST: df[COL_GAST].where(es_jorge), COL_OBS: df[COL_OBS].where(es_jorge)}
+    resumen = df.assign(**por_conductor, **del_dia).groupby(
+        COL_FECHA, sort=False, as_index=False, observed=True
+    ).agg(
+        **{c: (c, "sum") for c in CONDUCTORES},
+        **{COL_GAST: (COL_GAST, "first"), COL_OBS: (COL_OBS, "first")}
+    )
     resumen[COL_GAST] = resumen[COL_GAST].fillna(0)
     resumen[COL_OBS] = resumen[COL_OBS].fillna("")
 
@@ -183,6 +289,19 @@ def daily_summary(df):
     # ✅ ORDEN: más reciente arriba
     return resumen.sort_values(COL_FECHA, ascending=False).reset_index(drop=True)
 
+def cargar_df():
+    # El df se guarda en la sesión para mostrar: los reruns (y ambas pestañas) no
+    # vuelven a tocar read_sheet. Al guardar se le suma lo escrito; se descarta al
+    # vencer TTL_HOJA o con "Actualizar datos"
+    guardado = st.session_state.get("df")
+    if guardado is None or time.monotonic() - guardado[1] >= TTL_HOJA:
+        if guardado is not None:
+            # Vencido: la caché compartida puede ser igual de vieja, se lee de nuevo
+            read_sheet.clear()
+        guardado = (read_sheet(), time.monotonic())
+        st.session_state["df"] = guardado
+    return guardado[0]
+
 # =========================
 # UI
 # =========================
@@ -201,8 +320,6 @@ if "obs" not in st.session_state:
 if "fecha" not in st.session_state:
     st.session_state.fecha = date.today()
 
-df = read_sheet()
-
 tab1, tab2 = st.tabs(["➕ Registrar día", "📊 Resumen diario"])
 
 with tab1:
@@ -231,9 +348,24 @@ with tab1:
         g = st.session_state.gastos
         o = st.session_state.obs
 
-        df2 = upsert_day(df, f, pj, pe, g, o)
-        write_sheet(df2)
-        st.cache_data.clear()
+        df = cargar_df()
+        df2, updated_rows, new_rows = upsert_day(df, f, pj, pe, g, o)
+        # El df de la sesión puede no tener lo guardado desde otro celular: antes de
+        # agregar filas se relee la hoja (evita duplicar el día), y antes de
+        # reescribir filas se confirma que siguen en su posición
+        if new_rows or not filas_vigentes(updated_rows):
+            read_sheet.clear()
+            df = read_sheet()
+            # La sesión se queda con la lectura nueva aunque al final no haya nada que escribir
+            st.session_state["df"] = (df, time.monotonic())
+            df2, updated_rows, new_rows = upsert_day(df, f, pj, pe, g, o)
+        if updated_rows or new_rows:
+            # Hoja vacía: se escribe el encabezado antes de las filas nuevas
+            write_sheet(updated_rows, new_rows, header=df.empty and not get_ws().row_values(1))
+            read_sheet.clear()
+            # df2 solo suma lo escrito aquí a la lectura anterior: se conserva la hora de
+            # esa lectura para que venza a tiempo y se vean los cambios de otros
+            st.session_state["df"] = (df2, st.session_state["df"][1])
 
         # ✅ Mensaje claro (incluye "CONFIRMADO ERIK")
         st.success("✅ CONFIRMADO ERIK — Información guardada/actualizada correctamente.")
@@ -256,7 +388,7 @@ with tab1:
         st.rerun()
 
 with tab2:
-    res = daily_summary(df)
+    res = daily_summary(cargar_df())
 
     if res.empty:
         st.info("No hay datos registrados aún.")
@@ -272,7 +404,11 @@ with tab2:
         hasta = r2.date_input("Hasta", value=max_d)
         st.markdown('</div>', unsafe_allow_html=True)
 
-        filtrado = res[(res[COL_FECHA] >= desde) & (res[COL_FECHA] <= hasta)].copy()
+        # res viene ordenado descendente: búsqueda binaria sobre la vista ascendente
+        fechas = res[COL_FECHA].to_numpy()[::-1]
+        lo = np.searchsorted(fechas, desde, side="left")
+        hi = np.searchsorted(fechas, hasta, side="right")
+        filtrado = res.iloc[len(res) - hi:len(res) - lo].copy()
 
         # Métricas
         m1, m2 = st.columns(2)
@@ -292,10 +428,10 @@ with tab2:
             COL_OBS: "OBSERVACION"
         })
 
-        tabla["FECHA"] = tabla["FECHA"].apply(fecha_es)
+        tabla["FECHA"] = fecha_es_serie(tabla["FECHA"])
 
-        for col in ["JORGE", "ERIK", "GASTOS", "TOTAL_PRODUCIDO", "NETO"]:
-            tabla[col] = tabla[col].apply(formato_pesos)
+        cols_pesos = ["JORGE", "ERIK", "GASTOS", "TOTAL_PRODUCIDO", "NETO"]
+        tabla = tabla.assign(**{c: formato_pesos_serie(tabla[c]) for c in cols_pesos})
 
         st.dataframe(
             tabla[["FECHA", "JORGE", "ERIK", "GASTOS", "TOTAL_PRODUCIDO", "NETO", "OBSERVACION"]],
@@ -304,5 +440,6 @@ with tab2:
         )
 
         if st.button("🔄 Actualizar datos"):
-            st.cache_data.clear()
+            read_sheet.clear()
+            st.session_state.pop("df", None)
             st.rerun()